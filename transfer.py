@@ -1,31 +1,218 @@
 import os
+import re
 import json
+import time
+import random
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from collections import Counter
+from functools import partial
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import httpx
+import openai
 import pdfplumber
-import pandas as pd
-from openai import OpenAI
+import pymupdf as fitz
+from openai import AsyncOpenAI
+from openpyxl import Workbook
 
 # ============ BASIC CONFIG ============
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# The OpenAI client (and its pooled httpx client) is created per run inside
+# classify_tables_concurrently, so no client is bound to an event loop at import time.
 
 INPUT_DIR = "input-test"   # folder containing PDFs
 OUTPUT_DIR = "output"      # folder for generated Excel files
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))  # in-flight classifier requests
+OPENAI_MAX_RPM = float(os.getenv("OPENAI_MAX_RPM", "500"))        # client-side requests/minute budget
+OPENAI_MAX_TPM = float(os.getenv("OPENAI_MAX_TPM", "200000"))     # client-side tokens/minute budget
+OPENAI_MAX_ATTEMPTS = 3                                           # tries per request on retryable errors
+# 429s, connection errors/timeouts (APITimeoutError is an APIConnectionError) and 5xx responses
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+CLASSIFIER_BATCH_SIZE = 10                                        # table previews per chat completion
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+NUMERIC_PAGE_MIN_DIGITS = 20  # a page with fewer digits (and no keyword) cannot hold a rates table
+MAX_RATE_TABLES = int(os.getenv("MAX_RATE_TABLES", "32"))  # stop parsing a PDF once this many are confirmed
+
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+PAGES_PER_TASK = 8         # pages parsed per task when a single PDF is split across processes
+# model decisions keyed by table-preview hash, reused across runs; next to this script, not the CWD
+CLASSIFY_CACHE_PATH = Path(__file__).resolve().parent / ".classify_cache.db"
+
+# Fraction of the RPM/TPM budget this process may use; set per worker by process_all_pdfs.
+_rate_limit_share = 1.0
+# Processes available for parsing the pages of one PDF; set per worker by process_all_pdfs.
+_page_workers = os.cpu_count() or 1
+
+# ============ CLIENT-SIDE RATE LIMITING ============
+
+@dataclass
+class RateLimiter:
+    """
+    Token bucket for both requests/minute and tokens/minute
+    (same scheme as openai-cookbook's api_request_parallel_processor.py).
+    Capacity refills continuously and is capped at one minute's budget.
+    """
+    max_rpm: float
+    max_tpm: float
+    available_request_capacity: float = field(init=False)
+    available_token_capacity: float = field(init=False)
+    last_update: float = field(init=False)
+    _lock: asyncio.Lock = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.available_request_capacity = self.max_rpm
+        self.available_token_capacity = self.max_tpm
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _replenish(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.available_request_capacity = min(
+            self.max_rpm, self.available_request_capacity + elapsed * self.max_rpm / 60
+        )
+        self.available_token_capacity = min(
+            self.max_tpm, self.available_token_capacity + elapsed * self.max_tpm / 60
+        )
+        self.last_update = now
+
+    async def acquire(self, tokens: int):
+        """Wait until one request and `tokens` tokens are available, then consume them."""
+        tokens = min(tokens, self.max_tpm)  # a single oversized request must still go through eventually
+        async with self._lock:
+            while True:
+                self._replenish()
+                if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                    self.available_request_capacity -= 1
+                    self.available_token_capacity -= tokens
+                    return
+                await asyncio.sleep(0.05)
+
+    def update_from_headers(self, headers):
+        """Never assume more capacity than the server reports via x-ratelimit-remaining-*."""
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        try:
+            if remaining_requests is not None:
+                self.available_request_capacity = min(self.available_request_capacity, float(remaining_requests))
+            if remaining_tokens is not None:
+                self.available_token_capacity = min(self.available_token_capacity, float(remaining_tokens))
+        except ValueError:
+            pass
+
+
+# ============ CLASSIFICATION CACHE ============
+# sqlite rather than shelve: several PDF worker processes may write at the same time.
+# The connection is opened lazily so it is never shared across a fork.
+# The cache is best-effort: any sqlite error is a miss (or a skipped write), never a failed run.
+
+_cache_conn = None
+_cache_disabled = False
+_cache_lock = threading.Lock()
+
+
+def _cache_error(exc: sqlite3.Error):
+    global _cache_disabled
+    if not _cache_disabled:
+        print(f"  [WARN] Classification cache unavailable ({CLASSIFY_CACHE_PATH}): {exc}")
+    _cache_disabled = True
+
+
+def _get_cache():
+    global _cache_conn
+    if _cache_conn is None and not _cache_disabled:
+        try:
+            conn = sqlite3.connect(CLASSIFY_CACHE_PATH, timeout=30, check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+            conn.commit()
+            _cache_conn = conn
+        except sqlite3.Error as e:
+            _cache_error(e)
+    return _cache_conn
+
+
+def classification_cache_key(table_preview, model: str) -> str:
+    # the prompt is part of the key so rewording it invalidates old decisions
+    blob = json.dumps(
+        {"model": model, "prompt": CLASSIFIER_SYSTEM_PROMPT, "table_preview": table_preview},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.blake2b(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def cache_get(key: str):
+    with _cache_lock:
+        conn = _get_cache()
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("SELECT result FROM decisions WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:  # e.g. "database is locked" past the timeout
+            print(f"  [WARN] Classification cache read failed: {e}")
+            return None
+    return json.loads(row[0]) if row else None
+
+
+def cache_put(key: str, result: dict):
+    with _cache_lock:
+        conn = _get_cache()
+        if conn is None:
+            return
+        try:
+            conn.execute("INSERT OR REPLACE INTO decisions (key, result) VALUES (?, ?)", (key, json.dumps(result)))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"  [WARN] Classification cache write failed: {e}")
+
+
+# ============ LOCAL HEURISTICS ============
+
+# page-text keywords (light signal)
+# page-text keywords, matched as whole words/phrases (so "corporate" is not "rate")
+KEYWORDS = [
+    "cost", "costs", "rate", "rates", "premium", "premiums", "weekly", "monthly",
+    "death", "tpd", "income protection",
+    "waiting period", "benefit period", "cover"
+]
+
+# header-cell keywords, matched as whole words (so "Agent" is not "age")
+HEADER_KW = {"age", "premium", "premiums", "rate", "rates", "cost", "costs", "tpd", "ip"}
+
+# terms the model prompt excludes, matched as whole words/phrases in the table itself;
+# a table containing any of them is never accepted locally
+EXCLUDE_KW = ["contact", "call us", "claim", "claims", "beneficiary", "beneficiaries", "help"]
+
+ANSWER_RE = re.compile(r"(\d+)\s*([YN])\b")  # one "<index><Y|N>" entry of the classifier reply
+
+INVALID_SHEET_CHARS = re.compile(r"[\\*?:/\[\]]")  # characters Excel rejects in sheet names
+
+
 # ============ MODEL: classify whether a table is a rates/premium table ============
 
 CLASSIFIER_SYSTEM_PROMPT = """
 You are a table classifier for Australian insurance / superannuation PDFs.
 
-You will receive a JSON payload:
+You will receive a JSON payload with one or more tables:
 {
-  "page_index": X,
-  "page_text": "...",
-  "table_preview": [...]
+  "tables": [
+    {
+      "index": N,
+      "page_index": X,
+      "page_text": "...",
+      "table_preview": [...]
+    },
+    ...
+  ]
 }
 
-Your task is to decide whether the table is a **rates / premium table** (e.g., cost / rate / weekly cost / TPD / IP / Income Protection).
+For EACH table, independently decide whether it is a **rates / premium table** (e.g., cost / rate / weekly cost / TPD / IP / Income Protection).
 
 A table MUST satisfy **at least 2** of the following to be considered a rates table:
 
@@ -43,22 +230,17 @@ The following MUST be excluded (never a rates table):
 - very small tables (1–2 rows or columns)
 - FAQ, procedural, or descriptive tables
 
-Output strict JSON only:
-
-{
-  "is_rate_table": true/false,
-  "sheet_title": "xxx"   // empty if is_rate_table = false
-}
+Answer Y or N for each table: is this a rates/premium table?
+Reply with one entry per table: its "index" immediately followed by Y or N,
+entries separated by single spaces, and nothing else. Example for 3 tables: 0Y 1N 2Y
 """
 
 
-def classify_table_with_model(page_index: int, page_text: str, table_preview, model: str = "gpt-4o-mini") -> dict:
+def passes_prefilter(table_preview) -> bool:
     """
-    Robust rate table identification strategy:
+    Cheap local checks run before any model call:
     1. Structural check (avoid false positives)
     2. Numeric-row detection (core rule)
-    3. Keyword detection
-    4. Model-based classification
     """
 
     # ========== STRUCTURAL FILTER ==========
@@ -66,9 +248,14 @@ def classify_table_with_model(page_index: int, page_text: str, table_preview, mo
     num_cols = max([len(r) for r in table_preview]) if table_preview else 0
 
     if num_rows < 4 or num_cols < 4:
-        return {"is_rate_table": False, "sheet_title": ""}
+        return False
 
     # ========== NUMERIC ROW CHECK (strong indicator of rate tables) ==========
+    # A legit rates table should have at least 2 numeric rows
+    return count_numeric_rows(table_preview) >= 2
+
+
+def count_numeric_rows(table_preview) -> int:
     def is_numeric_row(row):
         digit_cells = 0
         total = len(row)
@@ -77,82 +264,307 @@ def classify_table_with_model(page_index: int, page_text: str, table_preview, mo
                 digit_cells += 1
         return (digit_cells / total) >= 0.5  # ≥50% digits means this is a numeric row
 
-    numeric_row_count = sum(is_numeric_row(r) for r in table_preview)
+    return sum(is_numeric_row(r) for r in table_preview if r)
 
-    # A legit rates table should have at least 2 numeric rows
-    if numeric_row_count < 2:
+
+def word_text(text) -> str:
+    """Lower-cased words of text joined by single spaces and padded, for has_term lookups."""
+    return " " + " ".join(re.findall(r"[a-z]+", str(text or "").lower())) + " "
+
+
+def has_term(words: str, terms) -> bool:
+    """True if any term (a word or space-separated phrase) occurs whole in word_text output."""
+    return any(f" {t} " in words for t in terms)
+
+
+def header_keyword_cells(table_preview) -> list:
+    """Header cells (first preview row) containing a HEADER_KW word."""
+    hits = []
+    for c in (table_preview[0] if table_preview else []):
+        if c is None:
+            continue
+        words = re.findall(r"[a-z]+", str(c).lower())
+        if HEADER_KW.intersection(words):
+            hits.append(str(c))
+    return hits
+
+
+def classify_table_locally(page_index: int, page_text: str, table_preview):
+    """
+    Deterministic decision for tables that passed passes_prefilter.
+    Score = (≥3 numeric rows) + (page keyword hit) + (header keyword hit):
+    - score 3 and no EXCLUDE_KW term in the table preview → accept without the model
+    - no page keyword and no header keyword → reject without the model
+    Returns the decision dict, or None when the table is ambiguous and needs the model.
+    """
+    numeric_row_count = count_numeric_rows(table_preview)
+    hit_keyword = has_term(word_text(page_text), KEYWORDS)
+    header_hits = header_keyword_cells(table_preview)
+
+    if not hit_keyword and not header_hits:
         return {"is_rate_table": False, "sheet_title": ""}
 
-    # ========== KEYWORD CHECK (light, not strict) ==========
-    KEYWORDS = [
-        "cost", "rate", "premium", "weekly", "monthly",
-        "death", "tpd", "income protection",
-        "waiting period", "benefit period", "cover"
-    ]
+    table_words = word_text(" ".join(str(c) for row in table_preview for c in (row or []) if c is not None))
+    excluded = has_term(table_words, EXCLUDE_KW)
 
-    text_lower = (page_text or "").lower()
-    hit_keyword = any(k in text_lower for k in KEYWORDS)
+    score = int(numeric_row_count >= 3) + int(hit_keyword) + int(bool(header_hits))
+    if score < 3 or excluded:
+        return None
 
-    # Even if keyword missed → model will still decide
-    # (so no early exit here)
+    return {"is_rate_table": True, "sheet_title": header_sheet_title(page_index, table_preview)}
+
+
+def header_sheet_title(page_index: int, table_preview) -> str:
+    """
+    Sheet title from the first header keyword cell other than a bare "Age",
+    e.g. "Death rates page 4"; empty if the header has no keyword cell.
+    """
+    header_hits = header_keyword_cells(table_preview)
+    if not header_hits:
+        return ""
+    title_cell = next((c for c in header_hits if c.strip().lower() != "age"), header_hits[0])
+    label = INVALID_SHEET_CHARS.sub(" ", " ".join(title_cell.split()))[:20].strip()
+    return f"{label or 'Rates'} page {page_index+1}"
+
+
+async def classify_tables_batch(client: AsyncOpenAI, limiter: RateLimiter, items: list,
+                                model: str = "gpt-4o-mini") -> list:
+    """
+    Model-based classification of up to CLASSIFIER_BATCH_SIZE tables that
+    classify_table_locally left undecided, in a single chat completion.
+    The model answers one Y/N letter per table; titles are derived locally.
+    Returns one {"is_rate_table": bool} per item, in order; a table missing
+    from the model's answer comes back as a ValueError.
+    """
+
+    tables = []
+    for i, item in enumerate(items):
+        text_lower = (item["page_text"] or "").lower()
+        tables.append({
+            "index": i,
+            "page_index": item["page_idx"],
+            "page_text": text_lower[:800],  # truncated hard so a full batch stays small
+            "table_preview": item["preview"]
+        })
 
     # ========== CALL MODEL FOR FINAL DECISION ==========
-    payload = {
-        "page_index": page_index,
-        "page_text": text_lower[:1500],
-        "table_preview": table_preview
-    }
-
-    resp = client.chat.completions.create(
-        model=model,
-        response_format={"type": "json_object"},
-        messages=[
-            {"role": "system", "content": CLASSIFIER_SYSTEM_PROMPT},
-            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
-        ],
-        temperature=0,
-        max_tokens=800
-    )
+    user_content = json.dumps({"tables": tables}, ensure_ascii=False)
+    max_tokens = 4 * len(items) + 8  # "<index><Y|N> " is ~2-3 tokens per table, plus headroom
+    # rough estimate: ~4 chars per token for the prompt, plus the completion budget
+    est_tokens = (len(CLASSIFIER_SYSTEM_PROMPT) + len(user_content)) // 4 + max_tokens
+
+    for attempt in range(OPENAI_MAX_ATTEMPTS):
+        await limiter.acquire(est_tokens)
+        try:
+            raw_resp = await client.chat.completions.with_raw_response.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": CLASSIFIER_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_content}
+                ],
+                temperature=0,
+                max_tokens=max_tokens
+            )
+        except RETRYABLE_ERRORS:
+            if attempt == OPENAI_MAX_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(2 ** attempt + random.random())  # exponential backoff with jitter
+            continue
+
+        limiter.update_from_headers(raw_resp.headers)
+        resp = raw_resp.parse()
+        raw = resp.choices[0].message.content or ""
+        # answers carry their index, so a dropped or extra entry cannot shift the others;
+        # an index answered twice with different letters counts as unanswered
+        answers = {}
+        for idx, letter in ANSWER_RE.findall(raw.upper()):
+            answers.setdefault(int(idx), set()).add(letter)
+        return [
+            {"is_rate_table": answers[i] == {"Y"}} if len(answers.get(i, ())) == 1
+            else ValueError(f"no unambiguous classification returned for batch index {i}")
+            for i in range(len(items))
+        ]
+
+
+async def classify_tables_concurrently(jobs: list, model: str = "gpt-4o-mini") -> list:
+    """
+    Fan out classification of all candidate tables of one PDF, CLASSIFIER_BATCH_SIZE per request.
+    Tables already in the classification cache are not sent again.
+    Returns one result per job, in order; failed calls come back as the raised exception.
+    """
+    keys = [classification_cache_key(job["preview"], model) for job in jobs]
+    results = [cache_get(key) for key in keys]
+    pending = [i for i, res in enumerate(results) if res is None]
+    if not pending:
+        return results
+
+    sem = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    limiter = RateLimiter(max_rpm=OPENAI_MAX_RPM * _rate_limit_share, max_tpm=OPENAI_MAX_TPM * _rate_limit_share)
+    batches = [pending[i:i + CLASSIFIER_BATCH_SIZE] for i in range(0, len(pending), CLASSIFIER_BATCH_SIZE)]
+
+    # one keep-alive pool for every request of the run; HTTP/2 multiplexes the fan-out over few connections
+    http_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT, http2=True)
+    try:
+        # retries are handled by classify_tables_batch so they go through the limiter
+        client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"), max_retries=0, timeout=HTTP_TIMEOUT, http_client=http_client
+        )
+
+        async def run(batch):
+            async with sem:
+                return await classify_tables_batch(client, limiter, [jobs[i] for i in batch], model=model)
+
+        batch_results = await asyncio.gather(*(run(batch) for batch in batches), return_exceptions=True)
+    finally:
+        await http_client.aclose()
+
+    for batch, res in zip(batches, batch_results):
+        # a failed request fails every table in its batch
+        for i, cls in zip(batch, [res] * len(batch) if isinstance(res, Exception) else res):
+            results[i] = cls
+            if not isinstance(cls, Exception):
+                cache_put(keys[i], cls)
+    return results
+
+
+def _iter_pages(pdf_path: Path, page_indices):
+    """
+    Yield (page_idx, page_text, tables) for the given pages.
+    PyMuPDF does the parsing; pdfplumber is only opened for pages where
+    find_tables() found nothing but the text looks numeric.
+    Pages with neither a keyword nor numeric-looking text skip table detection.
+    """
+    plumber_pdf = None
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            for page_idx in page_indices:
+                page = doc[page_idx]
+                page_text = page.get_text("text") or ""
+                numeric_page = sum(ch.isdigit() for ch in page_text) >= NUMERIC_PAGE_MIN_DIGITS
+
+                if not numeric_page and not has_term(word_text(page_text), KEYWORDS):
+                    yield page_idx, page_text, []
+                    continue
+
+                tables = [t.extract() for t in page.find_tables().tables]
+
+                if not tables and numeric_page:
+                    if plumber_pdf is None:
+                        # no laparams: passing any turns on pdfminer's layout analysis
+                        plumber_pdf = pdfplumber.open(str(pdf_path))
+                    plumber_page = plumber_pdf.pages[page_idx]
+                    tables = plumber_page.extract_tables() or []
+                    plumber_page.close()  # drop cached chars/curves/images for this page (pdfplumber >= 0.10.4)
+
+                yield page_idx, page_text, tables
+    finally:
+        if plumber_pdf is not None:
+            plumber_pdf.close()
+
 
-    raw = resp.choices[0].message.content
-    return json.loads(raw)
+def _parse_page_range(pdf_path: Path, start: int, stop: int) -> list:
+    return list(_iter_pages(pdf_path, range(start, stop)))
+
+
+def iter_page_tables(pdf_path: Path):
+    """
+    Yield (page_idx, page_text, tables) for every page, in page order.
+    When this process has spare cores, pages are parsed in chunks of
+    PAGES_PER_TASK by a process pool, each task opening the PDF once.
+    """
+    with fitz.open(str(pdf_path)) as doc:
+        page_count = doc.page_count
+
+    chunks = [(s, min(s + PAGES_PER_TASK, page_count)) for s in range(0, page_count, PAGES_PER_TASK)]
+    if _page_workers <= 1 or len(chunks) <= 1:
+        yield from _iter_pages(pdf_path, range(page_count))
+        return
+
+    # PyMuPDF is not thread-safe and neither parser releases the GIL, so use processes, not threads
+    ex = ProcessPoolExecutor(max_workers=min(_page_workers, len(chunks)))
+    try:
+        starts, stops = zip(*chunks)
+        for chunk in ex.map(_parse_page_range, repeat(pdf_path), starts, stops):
+            yield from chunk
+    finally:
+        ex.shutdown(cancel_futures=True)
 
 
 def process_single_pdf(pdf_path: Path, model: str = "gpt-4o-mini"):
     print(f"\nProcessing PDF: {pdf_path.name}")
+    jobs = []         # candidate tables that passed the local prefilter
     rate_tables = []  # list of {sheet_title, data}
+    confirmed = 0     # tables accepted locally so far
+    stopped_early = False
 
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        for page_idx, page in enumerate(pdf.pages):
-            page_text = page.extract_text() or ""
-            tables = page.extract_tables() or []
-
-            if not tables:
-                continue
-
-            for t_idx, tbl in enumerate(tables):
-                if not tbl:
-                    continue
+    for page_idx, page_text, tables in iter_page_tables(pdf_path):
+        # rates usually sit in one section; stop parsing once enough are confirmed
+        if confirmed >= MAX_RATE_TABLES:
+            print(f"  Reached MAX_RATE_TABLES={MAX_RATE_TABLES}, skipping pages from {page_idx+1}")
+            stopped_early = True
+            break
 
-                # extract preview: first 6 rows, first 8 columns
-                preview = [row[:8] for row in tbl[:6]]
+        if not tables:
+            continue
 
-                try:
-                    cls = classify_table_with_model(page_idx, page_text, preview, model=model)
-                except Exception as e:
-                    print(f"  [WARN] Model classification failed page={page_idx+1}, table={t_idx+1}: {e}")
-                    continue
+        for t_idx, tbl in enumerate(tables):
+            if not tbl:
+                continue
 
-                if not cls.get("is_rate_table"):
-                    continue  # skip non-rate tables
+            # extract preview: first 6 rows, first 8 columns
+            preview = [row[:8] for row in tbl[:6]]
 
-                raw_title = cls.get("sheet_title") or f"Rates page {page_idx+1} table {t_idx+1}"
-                sheet_title = raw_title.strip() or f"Rates page {page_idx+1} table {t_idx+1}"
+            if not passes_prefilter(preview):
+                continue
 
-                rate_tables.append({
-                    "sheet_title": sheet_title,
-                    "data": tbl
-                })
+            cls = classify_table_locally(page_idx, page_text, preview)
+            if cls and cls.get("is_rate_table"):
+                confirmed += 1
+
+            jobs.append({
+                "page_idx": page_idx,
+                "t_idx": t_idx,
+                "page_text": page_text,
+                "preview": preview,
+                "data": tbl,
+                "cls": cls
+            })
+
+    # only ambiguous tables go to the model
+    model_jobs = [job for job in jobs if job["cls"] is None]
+    if model_jobs:
+        results = asyncio.run(classify_tables_concurrently(model_jobs, model=model))
+        for job, cls in zip(model_jobs, results):
+            job["cls"] = cls
+    print(f"  {len(jobs) - len(model_jobs)} table(s) decided locally, {len(model_jobs)} by the model classifier")
+
+    for job in jobs:
+        page_idx, t_idx, cls = job["page_idx"], job["t_idx"], job["cls"]
+
+        if isinstance(cls, Exception):
+            print(f"  [WARN] Model classification failed page={page_idx+1}, table={t_idx+1}: {cls}")
+            continue
+
+        if not cls.get("is_rate_table"):
+            continue  # skip non-rate tables
+
+        # model decisions carry no title, so fall back to the header-derived one
+        raw_title = (
+            cls.get("sheet_title")
+            or header_sheet_title(page_idx, job["preview"])
+            or f"Rates page {page_idx+1} table {t_idx+1}"
+        )
+        sheet_title = raw_title.strip() or f"Rates page {page_idx+1} table {t_idx+1}"
+
+        rate_tables.append({
+            "sheet_title": sheet_title,
+            "data": job["data"]
+        })
+
+    # only when parsing stopped at the cap: model-accepted tables may push past it, keep the first ones
+    if stopped_early and len(rate_tables) > MAX_RATE_TABLES:
+        print(f"  Dropping {len(rate_tables) - MAX_RATE_TABLES} rate table(s) beyond MAX_RATE_TABLES={MAX_RATE_TABLES}")
+        rate_tables = rate_tables[:MAX_RATE_TABLES]
 
     if not rate_tables:
         print("  No rate tables detected. Skipping.")
@@ -162,21 +574,31 @@ def process_single_pdf(pdf_path: Path, model: str = "gpt-4o-mini"):
     out_path = Path(OUTPUT_DIR) / f"{pdf_path.stem}_rates.xlsx"
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-        used_names = set()
-
-        for idx, tbl in enumerate(rate_tables):
-            base_name = tbl["sheet_title"][:31]  # Excel sheet name limit = 31 chars
-            name = base_name
-            k = 1
-            while name in used_names:
-                suffix = f"_{k}"
-                name = (base_name[: (31 - len(suffix))] + suffix)
-                k += 1
-            used_names.add(name)
-
-            df = pd.DataFrame(tbl["data"])
-            df.to_excel(writer, sheet_name=name, index=False)
+    # write-only workbook streams rows out instead of building a Cell object per value
+    wb = Workbook(write_only=True)
+    name_counts = Counter()
+    used_names = set()  # lower-cased: Excel sheet names are case-insensitive
+
+    for idx, tbl in enumerate(rate_tables):
+        base_name = tbl["sheet_title"][:31]  # Excel sheet name limit = 31 chars
+        # the per-base counter is the first guess; bump past names taken by other titles (e.g. a literal "A_2")
+        n = name_counts[base_name] + 1
+        while True:
+            suffix = f"_{n}"
+            name = base_name if n == 1 else base_name[: (31 - len(suffix))] + suffix
+            if name.lower() not in used_names:
+                break
+            n += 1
+        name_counts[base_name] = n
+        used_names.add(name.lower())
+
+        ws = wb.create_sheet(title=name)
+        n_cols = max((len(row) for row in tbl["data"]), default=0)
+        ws.append(list(range(n_cols)))  # column-number header row, as DataFrame.to_excel wrote it
+        for row in tbl["data"]:
+            ws.append(row)
+
+    wb.save(out_path)
 
     print(f"  Excel generated → {out_path}")
 
@@ -189,8 +611,18 @@ def process_all_pdfs(model: str = "gpt-4o-mini"):
         print("Please add PDF files to the input folder.")
         return
 
-    for pdf_path in pdf_files:
-        process_single_pdf(pdf_path, model=model)
+    # PDF parsing is CPU-bound, so PDFs run in separate processes.
+    # Each worker runs its own event loop and gets an equal share of the API rate budget
+    # and of the cores left over for page-level parsing.
+    n_workers = min(len(pdf_files), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(n_workers,)) as ex:
+        list(ex.map(partial(process_single_pdf, model=model), pdf_files))
+
+
+def _init_worker(n_workers: int):
+    global _rate_limit_share, _page_workers
+    _rate_limit_share = 1.0 / n_workers
+    _page_workers = max(1, (os.cpu_count() or 1) // n_workers)
 
 
 if __name__ == "__main__":
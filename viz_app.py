@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
@@ -6,6 +7,13 @@ from pathlib import Path
 
 FILE_PATH = Path("All_Rates_Comparison_final.xlsx")
 
+CATEGORY_COLS = ["Gender", "Occupation", "BenefitType", "BenefitPeriod", "WaitingPeriod"]
+INDEX_COLS = ["Gender", "Occupation", "BenefitType"]  # filters every view applies; indexed once in load_data
+
+# Bump whenever read_workbook's output (parsing, columns, dtypes) changes: sidecars
+# written by another version are ignored and rebuilt.
+SIDECAR_VERSION = 2
+
 CUSTOM_CSS = """
 <style>
     :root {
@@ -34,11 +42,8 @@ CUSTOM_CSS = """
 """
 
 
-@st.cache_data(show_spinner=False)
-def load_data(path: Path) -> pd.DataFrame:
-    if not path.exists():
-        return pd.DataFrame()
-
+def read_workbook(path: Path) -> pd.DataFrame:
+    # pandas' openpyxl engine already loads the workbook read_only/data_only
     sheets = pd.read_excel(path, sheet_name=None)
     frames = []
 
@@ -67,7 +72,47 @@ def load_data(path: Path) -> pd.DataFrame:
     if not frames:
         return pd.DataFrame()
 
-    return pd.concat(frames, ignore_index=True)
+    df = pd.concat(frames, ignore_index=True)
+
+    # Company rate columns are coerced to numbers once here rather than on every rerun
+    for c in get_company_columns(df):
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype("float64")
+
+    # Categoricals for the low-cardinality filter columns
+    return df.astype({c: "category" for c in CATEGORY_COLS if c in df.columns})
+
+
+@st.cache_data(show_spinner=False)
+def load_data(path: Path) -> pd.DataFrame:
+    if not path.exists():
+        return pd.DataFrame()
+
+    # Parquet sidecar next to the workbook, reused while it is at least as new as the Excel file
+    # and was written by this SIDECAR_VERSION of read_workbook
+    parquet = path.with_name(f"{path.stem}.v{SIDECAR_VERSION}.parquet")
+    df = None
+    if parquet.exists() and parquet.stat().st_mtime >= path.stat().st_mtime:
+        try:
+            df = pd.read_parquet(parquet)
+        except (ImportError, ValueError, TypeError, OSError):
+            df = None
+
+    if df is None:
+        df = read_workbook(path)
+        if df.empty:
+            return df
+        try:
+            df.to_parquet(parquet, compression="zstd", index=False)
+        except (ImportError, ValueError, TypeError, OSError):
+            pass  # no pyarrow, unwritable folder or a column Arrow cannot type: just skip the sidecar
+
+    # Sorted MultiIndex over the filters every view applies so filter_rows can slice
+    # with df.xs instead of scanning. The columns are kept (drop=False) so the sidebar
+    # can still read them directly.
+    index_cols = [c for c in INDEX_COLS if c in df.columns]
+    if index_cols:
+        df = df.set_index(index_cols, drop=False).sort_index()
+    return df
 
 
 def get_company_columns(df: pd.DataFrame) -> list:
@@ -83,16 +128,32 @@ def get_company_columns(df: pd.DataFrame) -> list:
     return [c for c in df.columns if c not in base_cols]
 
 
-def build_lookup(df: pd.DataFrame, age: int, gender: str, occupation: str, benefit: str) -> pd.DataFrame:
-    benefit_col = "BenefitType" if "BenefitType" in df.columns else None
-    query = df.copy()
-    query = query[query["Age"] == age]
-    query = query[query["Gender"] == gender]
-    query = query[query["Occupation"] == occupation]
-    if benefit_col:
-        query = query[query[benefit_col] == benefit]
+def filter_rows(df: pd.DataFrame, gender: str, occupation: str, benefit: str,
+                benefit_period: str | None = None, waiting_period: str | None = None) -> pd.DataFrame:
+    """Rows matching the sidebar filters; indexed filters are sliced via df.xs, the rest masked."""
+    filters = {"Gender": gender, "Occupation": occupation, "BenefitType": benefit}
+    levels = [name for name in INDEX_COLS if name in df.index.names]
+    try:
+        sub = df.xs(tuple(filters[name] for name in levels), level=levels) if levels else df
+    except KeyError:
+        return df.iloc[0:0]
+
+    mask = np.ones(len(sub), dtype=bool)
+    for name, value in filters.items():
+        if name not in levels and name in sub.columns:
+            mask &= sub[name].values == value
+    if benefit_period and "BenefitPeriod" in sub.columns:
+        mask &= sub["BenefitPeriod"].values == benefit_period
+    if waiting_period and "WaitingPeriod" in sub.columns:
+        mask &= sub["WaitingPeriod"].values == waiting_period
+    return sub[mask]
 
+
+def build_lookup(df: pd.DataFrame, age: int, gender: str, occupation: str, benefit: str) -> pd.DataFrame:
     company_cols = get_company_columns(df)
+    sub = filter_rows(df, gender, occupation, benefit)
+    query = sub.loc[sub["Age"].values == age, company_cols]
+
     rows = []
     for comp in company_cols:
         rate = None
@@ -108,30 +169,25 @@ def build_lookup(df: pd.DataFrame, age: int, gender: str, occupation: str, benef
 
 def build_trend(df: pd.DataFrame, companies: list, gender: str, occupation: str, benefit: str,
                 benefit_period: str | None = None, waiting_period: str | None = None) -> tuple[pd.DataFrame, list]:
-    benefit_col = "BenefitType" if "BenefitType" in df.columns else None
-    filtered = df.copy()
-    filtered = filtered[filtered["Gender"] == gender]
-    filtered = filtered[filtered["Occupation"] == occupation]
-    if benefit_col:
-        filtered = filtered[filtered[benefit_col] == benefit]
-    if benefit_period and "BenefitPeriod" in filtered.columns:
-        filtered = filtered[filtered["BenefitPeriod"] == benefit_period]
-    if waiting_period and "WaitingPeriod" in filtered.columns:
-        filtered = filtered[filtered["WaitingPeriod"] == waiting_period]
-
     melt_cols = [c for c in get_company_columns(df) if not companies or c in companies]
     if not melt_cols:
         return pd.DataFrame(), []
 
-    missing = []
-    for c in melt_cols:
-        filtered[c] = pd.to_numeric(filtered[c], errors="coerce")
-        if filtered[c].dropna().empty:
-            missing.append(c)
-
-    long_df = filtered[["Age"] + melt_cols].melt(id_vars=["Age"], var_name="Company", value_name="Rate")
-    long_df = long_df.dropna(subset=["Rate"])
-    long_df["Company"] = long_df["Company"].str.replace(" rates", "", regex=False)
+    sub = filter_rows(df, gender, occupation, benefit, benefit_period, waiting_period)
+    filtered = sub[["Age", *melt_cols]]
+
+    missing = [c for c in melt_cols if filtered[c].dropna().empty]
+
+    # long form straight from the NumPy buffers, column-major like DataFrame.melt
+    ages = filtered["Age"].to_numpy()
+    mat = filtered[melt_cols].to_numpy(dtype="float64")  # (n, C)
+    n, n_comp = mat.shape
+    names = np.array([c.replace(" rates", "") for c in melt_cols], dtype=object)
+    age_col = np.tile(ages, n_comp)
+    comp_col = np.repeat(names, n)
+    rate_col = mat.ravel(order="F")
+    keep = ~np.isnan(rate_col)
+    long_df = pd.DataFrame({"Age": age_col[keep], "Company": comp_col[keep], "Rate": rate_col[keep]})
     return long_df, missing
 
 
@@ -141,56 +197,36 @@ def build_relative_trend(df: pd.DataFrame, base_company: str, compare_companies:
     if not base_company or not compare_companies:
         return pd.DataFrame(), [], False
 
-    benefit_col = "BenefitType" if "BenefitType" in df.columns else None
-    filtered = df.copy()
-    filtered = filtered[filtered["Gender"] == gender]
-    filtered = filtered[filtered["Occupation"] == occupation]
-    if benefit_col:
-        filtered = filtered[filtered[benefit_col] == benefit]
-    if benefit_period and "BenefitPeriod" in filtered.columns:
-        filtered = filtered[filtered["BenefitPeriod"] == benefit_period]
-    if waiting_period and "WaitingPeriod" in filtered.columns:
-        filtered = filtered[filtered["WaitingPeriod"] == waiting_period]
-
-    numeric_cols = [c for c in [base_company, *compare_companies] if c in filtered.columns]
-    for c in numeric_cols:
-        filtered[c] = pd.to_numeric(filtered[c], errors="coerce")
-
-    base_series = (
-        filtered[["Age", base_company]]
-        .dropna(subset=["Age", base_company])
-        .groupby("Age")[base_company]
+    numeric_cols = [c for c in [base_company, *compare_companies] if c in df.columns]
+    sub = filter_rows(df, gender, occupation, benefit, benefit_period, waiting_period)
+    filtered = sub[["Age", *numeric_cols]]
+
+    # one long frame for all companies, mean rate per (Age, Company), then every ratio in one division
+    companies = [base_company, *compare_companies]
+    long_df = (
+        filtered.melt(id_vars=["Age"], var_name="Company", value_name="Rate")
+        .dropna(subset=["Age", "Rate"])
+    )
+    agg = (
+        long_df.groupby(["Age", "Company"])["Rate"]
         .mean()
+        .unstack("Company")
+        .reindex(columns=companies)
     )
-    baseline_missing = base_series.empty
+    ratio = agg.div(agg[base_company], axis=0) * 100
 
-    rows = []
-    if not base_series.empty:
-        base_df = base_series.reset_index()
-        base_df["Company"] = base_company
-        base_df["Ratio"] = 100.0
-        rows.append(base_df[["Age", "Company", "Ratio"]])
-
-    missing = []
-    for comp in compare_companies:
-        comp_series = (
-            filtered[["Age", comp]]
-            .dropna(subset=["Age", comp])
-            .groupby("Age")[comp]
-            .mean()
-        )
-        joined = pd.DataFrame({"base": base_series, "comp": comp_series}).dropna()
-        if joined.empty:
-            missing.append(comp)
-            continue
-        joined["Company"] = comp
-        joined["Ratio"] = (joined["comp"] / joined["base"]) * 100
-        rows.append(joined.reset_index()[["Age", "Company", "Ratio"]])
+    baseline_missing = agg[base_company].dropna().empty
+    missing = [c for c in compare_companies if ratio[c].dropna().empty]
 
-    if not rows:
+    result = (
+        ratio.reset_index()
+        .melt(id_vars=["Age"], var_name="Company", value_name="Ratio")
+        .dropna(subset=["Ratio"])
+        .reset_index(drop=True)
+    )
+    if result.empty:
         return pd.DataFrame(), missing, baseline_missing
 
-    result = pd.concat(rows, ignore_index=True)
     result["Company"] = result["Company"].str.replace(" rates", "", regex=False)
     return result, missing, baseline_missing
 